@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
 
 from pathlib import Path
+from typing import Optional
 
 # Define the root directory (the parent of the 'app' directory)
 ROOT_DIR = Path(__file__).resolve().parent.parent
@@ -11,6 +12,32 @@ class Settings(BaseSettings):
     # The `DATABASE_URL` will be loaded from the .env file
     DATABASE_URL: str
 
+    # Connection pool tuning (override per environment via .env)
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    # Size of SQLAlchemy's compiled statement LRU cache
+    DB_QUERY_CACHE_SIZE: int = 1200
+    # Prepared statement caches, used only with the postgresql+asyncpg driver.
+    # Set both to 0 behind PgBouncer in transaction pooling mode.
+    DB_STATEMENT_CACHE_SIZE: int = 1024
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 256
+
+    # How long fetched upstream payloads are reused, in seconds
+    RATES_CACHE_TTL: int = 3600
+    COUNTRIES_CACHE_TTL: int = 86400
+
+    # Interval between scheduled background refreshes, in minutes
+    REFRESH_INTERVAL_MINUTES: int = 60
+
+    # Browser/CDN cache lifetime for the summary image, in seconds
+    IMAGE_CACHE_MAX_AGE: int = 3600
+    # Internal Nginx location for the summary image (e.g. "/_cache/summary.png");
+    # when set, the image bytes are sent by Nginx via X-Accel-Redirect
+    IMAGE_ACCEL_REDIRECT: Optional[str] = None
+
     class Config:
         env_file = ".env"
 
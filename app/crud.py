@@ -1,31 +1,63 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, update, delete
+from sqlalchemy import select, func, update, delete, insert, bindparam
+from sqlalchemy.dialects import mysql, postgresql
 from sqlalchemy.orm import selectinload
-from typing import Optional, List
-from . import models, schemas
-from datetime import datetime
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+from . import models
+from datetime import datetime, timezone
+
+# Columns overwritten when an existing country is upserted
+UPDATE_COLS = (
+    "name",
+    "capital",
+    "region",
+    "population",
+    "currency_code",
+    "exchange_rate",
+    "estimated_gdp",
+    "flag_url",
+)
+
+# Hot-path statements built once at import and reused on every call
+_COUNTRY_BY_NAME = select(models.Country).where(
+    models.Country.name_lower == bindparam("name_lower")
+)
+_APP_STATUS = select(models.AppStatus).where(models.AppStatus.id == 1)
+_LAST_REFRESHED_AT = select(models.AppStatus.last_refreshed_at).where(models.AppStatus.id == 1)
+_STATUS_BUNDLE = select(
+    select(func.count(models.Country.id)).scalar_subquery(),
+    _LAST_REFRESHED_AT.scalar_subquery(),
+)
 
 # --- Country CRUD ---
 
+def _gdp_desc(db: AsyncSession):
+    """
+    Order by estimated GDP, highest first, with unknown (NULL) GDPs last.
+    MySQL already sorts NULLs last on DESC and rejects NULLS LAST;
+    PostgreSQL sorts them first unless told otherwise.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return models.Country.estimated_gdp.desc().nulls_last()
+    return models.Country.estimated_gdp.desc()
+
 async def get_country_by_name(db: AsyncSession, name: str) -> Optional[models.Country]:
     """
     Fetch a single country by its name (case-insensitive).
     """
-    result = await db.execute(
-        select(models.Country).where(func.lower(models.Country.name) == name.lower())
-    )
+    result = await db.execute(_COUNTRY_BY_NAME, {"name_lower": name.lower()})
     return result.scalars().first()
 
-async def get_countries(
+def _countries_query(
     db: AsyncSession, 
     region: Optional[str], 
     currency: Optional[str], 
     sort: Optional[str], 
     skip: int = 0, 
-    limit: int = 100
-) -> List[models.Country]:
+    limit: Optional[int] = 100
+):
     """
-    Fetch a list of countries with optional filtering and sorting.
+    Build the filtered and sorted country query shared by list and stream.
     """
     query = select(models.Country)
 
@@ -37,15 +69,45 @@ async def get_countries(
 
     if sort == "gdp_desc":
         # Sort by GDP, putting NULLs last
-        query = query.order_by(models.Country.estimated_gdp.desc())
+        query = query.order_by(_gdp_desc(db))
     else:
         # Default sort by name
         query = query.order_by(models.Country.name.asc())
 
-    query = query.offset(skip).limit(limit)
+    return query.offset(skip).limit(limit)
+
+async def get_countries(
+    db: AsyncSession, 
+    region: Optional[str], 
+    currency: Optional[str], 
+    sort: Optional[str], 
+    skip: int = 0, 
+    limit: int = 100
+) -> List[models.Country]:
+    """
+    Fetch a list of countries with optional filtering and sorting.
+    """
+    query = _countries_query(db, region, currency, sort, skip, limit)
     result = await db.execute(query)
     return result.scalars().all()
 
+async def stream_countries(
+    db: AsyncSession, 
+    region: Optional[str], 
+    currency: Optional[str], 
+    sort: Optional[str], 
+    skip: int = 0, 
+    limit: Optional[int] = None
+) -> AsyncIterator[models.Country]:
+    """
+    Stream countries from a server-side cursor in batches instead of
+    loading the whole result into memory.
+    """
+    query = _countries_query(db, region, currency, sort, skip, limit)
+    result = await db.stream_scalars(query.execution_options(yield_per=50))
+    async for country in result:
+        yield country
+
 async def get_countries_count(db: AsyncSession) -> int:
     """
     Get the total count of countries in the database.
@@ -53,31 +115,55 @@ async def get_countries_count(db: AsyncSession) -> int:
     result = await db.execute(select(func.count(models.Country.id)))
     return result.scalar() or 0
 
-async def upsert_country(db: AsyncSession, country_data: schemas.CountryCreate) -> models.Country:
+async def bulk_upsert_countries(db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
     """
-    Update a country if it exists by name, or create it if it doesn't.
+    Insert or update a whole batch of countries, keyed on the unique name_lower.
+    Uses a single native upsert statement on MySQL/PostgreSQL.
     """
-    # Check if country exists (case-insensitive)
-    db_country = await get_country_by_name(db, name=country_data.name)
-    
-    country_dict = country_data.model_dump()
-    
-    if db_country:
-        # Update existing country
-        await db.execute(
-            update(models.Country)
-            .where(models.Country.id == db_country.id)
-            .values(**country_dict)
+    if not rows:
+        return
+
+    # Collapse names that differ only in case (last one wins); a single
+    # upsert statement cannot touch the same key twice
+    rows = list({row["name_lower"]: row for row in rows}.values())
+
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "mysql":
+        stmt = mysql.insert(models.Country).values(rows)
+        stmt = stmt.on_duplicate_key_update({
+            **{col: stmt.inserted[col] for col in UPDATE_COLS},
+            "last_refreshed_at": func.now(),
+        })
+        await db.execute(stmt)
+    elif dialect == "postgresql":
+        stmt = postgresql.insert(models.Country).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Country.name_lower],
+            set_={
+                **{col: stmt.excluded[col] for col in UPDATE_COLS},
+                "last_refreshed_at": func.now(),
+            },
         )
-        # Refresh the object to get updated values
-        await db.refresh(db_country, attribute_names=country_dict.keys())
+        await db.execute(stmt)
     else:
-        # Insert new country
-        db_country = models.Country(**country_dict)
-        db.add(db_country)
-        await db.flush() # Flush to get the new object in the session
-    
-    return db_country
+        # Generic fallback: one SELECT for existing ids, then bulk INSERT + bulk UPDATE
+        result = await db.execute(
+            select(models.Country.id, models.Country.name_lower)
+            .where(models.Country.name_lower.in_([row["name_lower"] for row in rows]))
+        )
+        existing = {lowered: country_id for country_id, lowered in result.all()}
+
+        new_rows = [row for row in rows if row["name_lower"] not in existing]
+        updated_rows = [
+            {"id": existing[row["name_lower"]], **{col: row[col] for col in UPDATE_COLS}}
+            for row in rows
+            if row["name_lower"] in existing
+        ]
+        if new_rows:
+            await db.execute(insert(models.Country), new_rows)
+        if updated_rows:
+            await db.execute(update(models.Country), updated_rows)
 
 async def delete_country_by_name(db: AsyncSession, name: str) -> Optional[models.Country]:
     """
@@ -90,17 +176,18 @@ async def delete_country_by_name(db: AsyncSession, name: str) -> Optional[models
         return db_country
     return None
 
-async def get_top_gdp_countries(db: AsyncSession, limit: int = 5) -> List[models.Country]:
+async def get_top_gdp_projection(db: AsyncSession, limit: int = 5) -> List[Tuple[str, Optional[float]]]:
     """
-    Get the top N countries by estimated GDP.
+    Get the name and estimated GDP of the top N countries by estimated GDP.
+    Only the two columns are loaded, not full Country objects.
     """
     query = (
-        select(models.Country)
-        .order_by(models.Country.estimated_gdp.desc())
+        select(models.Country.name, models.Country.estimated_gdp)
+        .order_by(_gdp_desc(db))
         .limit(limit)
     )
     result = await db.execute(query)
-    return result.scalars().all()
+    return result.all()
 
 # --- AppStatus CRUD ---
 
@@ -108,9 +195,20 @@ async def get_app_status(db: AsyncSession) -> Optional[models.AppStatus]:
     """
     Get the global app status (singleton row).
     """
-    result = await db.execute(select(models.AppStatus).where(models.AppStatus.id == 1))
+    result = await db.execute(_APP_STATUS)
     return result.scalars().first()
 
+async def get_status_bundle(db: AsyncSession) -> Tuple[int, Optional[datetime]]:
+    """
+    Get the country count and the last refresh timestamp in one round-trip.
+    """
+    result = await db.execute(_STATUS_BUNDLE)
+    total, last_refreshed_at = result.one()
+    if last_refreshed_at is not None and last_refreshed_at.tzinfo is None:
+        # MySQL DATETIME (and SQLite) drop the zone; values are stored as UTC
+        last_refreshed_at = last_refreshed_at.replace(tzinfo=timezone.utc)
+    return total or 0, last_refreshed_at
+
 async def update_app_status(db: AsyncSession, refresh_time: datetime):
     """
     Update the global last_refreshed_at timestamp.
@@ -121,5 +219,4 @@ async def update_app_status(db: AsyncSession, refresh_time: datetime):
         db.add(status)
     else:
         new_status = models.AppStatus(id=1, last_refreshed_at=refresh_time)
-        db.add(new_status)
-    await db.flush()
\ No newline at end of file
+        db.add(new_status)
\ No newline at end of file
@@ -1,9 +1,31 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
 
-# Create the async engine
-engine = create_async_engine(settings.DATABASE_URL)
+database_url = make_url(settings.DATABASE_URL)
+connect_args = {}
+
+# asyncpg can keep repeated queries as server-side prepared statements
+if database_url.get_driver_name() == "asyncpg":
+    database_url = database_url.update_query_dict(
+        {"prepared_statement_cache_size": str(settings.DB_PREPARED_STATEMENT_CACHE_SIZE)}
+    )
+    connect_args["statement_cache_size"] = settings.DB_STATEMENT_CACHE_SIZE
+
+# Create the async engine with a pooled set of reusable connections
+engine = create_async_engine(
+    database_url,
+    connect_args=connect_args,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    query_cache_size=settings.DB_QUERY_CACHE_SIZE,
+)
 
 # Create a session maker
 AsyncSessionLocal = async_sessionmaker(
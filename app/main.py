@@ -1,20 +1,21 @@
-import os
-from fastapi import FastAPI, Depends, HTTPException, status, Query, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Request, BackgroundTasks
+from fastapi.responses import ORJSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.exceptions import RequestValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from typing import List, Optional
 
 from . import crud, models, schemas, services
 from .database import get_db, init_db, engine
 from .services import ServiceUnavailableException
-from .config import IMAGE_PATH
+from .config import IMAGE_PATH, settings
 
 # Create the FastAPI app
 app = FastAPI(
     title="Country Currency & Exchange API",
     description="An API to fetch, cache, and serve country and currency data.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # --- Event Handlers ---
@@ -22,15 +23,33 @@ app = FastAPI(
 @app.on_event("startup")
 async def on_startup():
     """
-    Initialize the database tables on startup.
+    Initialize the database tables, the shared HTTP client and the
+    periodic refresh scheduler on startup.
     """
     await init_db()
+    app.state.http = services.create_http_client()
+
+    scheduler = AsyncIOScheduler()
+    scheduler.add_job(
+        services.run_refresh,
+        "interval",
+        minutes=settings.REFRESH_INTERVAL_MINUTES,
+        # Always refetch upstream; the payload cache only serves manual refreshes
+        kwargs={"client": app.state.http, "force": True},
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.start()
+    app.state.scheduler = scheduler
 
 @app.on_event("shutdown")
 async def on_shutdown():
     """
-    Close the database engine connection on shutdown.
+    Stop the scheduler, then close the HTTP client and database engine
+    connection on shutdown.
     """
+    app.state.scheduler.shutdown(wait=False)
+    await app.state.http.aclose()
     await engine.dispose()
 
 # --- Custom Error Handlers ---
@@ -40,7 +59,7 @@ async def service_unavailable_handler(request: Request, exc: ServiceUnavailableE
     """
     Handle 503 errors from external API failures.
     """
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
         content={
             "error": "External data source unavailable",
@@ -58,7 +77,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         field = error["loc"][-1] if len(error["loc"]) > 1 else "body"
         details[str(field)] = error["msg"]
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_400_BAD_REQUEST,
         content={"error": "Validation failed", "details": details}
     )
@@ -68,7 +87,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     """
     Handle generic 404/other HTTP errors.
     """
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={"error": exc.detail}
     )
@@ -79,7 +98,7 @@ async def generic_exception_handler(request: Request, exc: Exception):
     Handle unexpected 500 internal server errors.
     """
     # Log the exception here (e.g., logging.error(exc, exc_info=True))
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content={"error": "Internal server error"}
     )
@@ -89,16 +108,26 @@ async def generic_exception_handler(request: Request, exc: Exception):
 @app.post(
     "/countries/refresh",
     summary="Refresh Country Data",
-    description="Fetches data from external APIs, updates the database, and generates a summary image.",
-    status_code=status.HTTP_200_OK
+    description="Schedules a background job that fetches data from external APIs, updates the database, and generates a summary image.",
+    status_code=status.HTTP_202_ACCEPTED
 )
-async def refresh_countries_data(db: AsyncSession = Depends(get_db)):
+async def refresh_countries_data(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    force: bool = Query(False, description="Bypass the cached upstream API responses")
+):
     """
-    Endpoint to trigger the data refresh process.
+    Endpoint to trigger the data refresh process without waiting for it.
     """
-    # The ServiceUnavailableException will be caught by the custom handler
-    result = await services.process_and_cache_countries(db)
-    return result
+    # A running refresh would make the new one a no-op; tell the caller
+    if services.refresh_in_progress():
+        return ORJSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"status": "already_running"}
+        )
+
+    background_tasks.add_task(services.run_refresh, request.app.state.http, force=force)
+    return {"status": "scheduled"}
 
 @app.get(
     "/countries",
@@ -110,14 +139,69 @@ async def get_all_countries(
     region: Optional[str] = Query(None, description="Filter by region (e.g., 'Africa')"),
     currency: Optional[str] = Query(None, description="Filter by currency code (e.g., 'NGN')"),
     sort: Optional[str] = Query(None, description="Sort by GDP (use 'gdp_desc')"),
+    stream: bool = Query(False, description="Stream every matching country as NDJSON"),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Get all countries, with filters for region, currency, and sorting by GDP.
     """
+    if stream:
+        rows = crud.stream_countries(db, region=region, currency=currency, sort=sort)
+        return StreamingResponse(
+            (
+                schemas.Country.model_validate(row).model_dump_json().encode() + b"\n"
+                async for row in rows
+            ),
+            media_type="application/x-ndjson"
+        )
+
     countries = await crud.get_countries(db, region=region, currency=currency, sort=sort)
     return countries
 
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches `etag`, using weak comparison
+    (a W/ prefix is ignored), as HTTP requires for If-None-Match.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+@app.get(
+    "/countries/image",
+    summary="Get Summary Image",
+    description="Serves the 'cache/summary.png' image generated during the last refresh."
+)
+async def get_summary_image(request: Request):
+    """
+    Serve the generated summary image file, with caching headers.
+    """
+    # Readiness is tracked in memory by the image generator, so no
+    # filesystem check is needed on the request path
+    etag = services.summary_image_etag()
+    if etag is None:
+        return ORJSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"error": "Summary image not found. Run /countries/refresh to generate it."}
+        )
+
+    headers = {
+        "Cache-Control": f"public, max-age={settings.IMAGE_CACHE_MAX_AGE}",
+        "ETag": etag,
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if settings.IMAGE_ACCEL_REDIRECT:
+        # Let Nginx send the file bytes itself
+        headers["X-Accel-Redirect"] = settings.IMAGE_ACCEL_REDIRECT
+        return Response(media_type="image/png", headers=headers)
+
+    return FileResponse(IMAGE_PATH, media_type="image/png", headers=headers)
+
 @app.get(
     "/countries/{name}",
     response_model=schemas.Country,
@@ -158,43 +242,12 @@ async def get_status(db: AsyncSession = Depends(get_db)):
     """
     Get the application's status.
     """
-    total = await crud.get_countries_count(db)
-    status_record = await crud.get_app_status(db)
-    timestamp = status_record.last_refreshed_at if status_record else None
+    # The refresh time is memoized in-process; only read it from the DB on
+    # a cold worker that has not refreshed yet
+    timestamp = services.get_last_refreshed_at()
+    if timestamp is not None:
+        total = await crud.get_countries_count(db)
+    else:
+        total, timestamp = await crud.get_status_bundle(db)
     
     return {"total_countries": total, "last_refreshed_at": timestamp}
-
-# @app.get(
-#     "/countries/image",
-#     summary="Get Summary Image",
-#     description="Serves the 'cache/summary.png' image generated during the last refresh."
-# )
-# async def get_summary_image():
-#     """
-#     Serve the generated summary image file.
-#     """
-#     image_path = "cache/summary.png"
-#     if not os.path.exists(image_path):
-#         return JSONResponse(
-#             status_code=status.HTTP_404_NOT_FOUND,
-#             content={"error": "Summary image not found. Run /countries/refresh to generate it."}
-#         )
-#     return FileResponse(image_path, media_type="image/png")
-@app.get(
-    "/countries/image",
-    summary="Get Summary Image",
-    description="Serves the 'cache/summary.png' image generated during the last refresh."
-)
-async def get_summary_image():
-    """
-    Serve the generated summary image file.
-    """
-    # Use the absolute path from the config
-    image_path = str(IMAGE_PATH)
-    
-    if not os.path.exists(image_path):
-        return JSONResponse(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content={"error": "Summary image not found. Run /countries/refresh to generate it."}
-        )
-    return FileResponse(image_path, media_type="image/png")
\ No newline at end of file
@@ -1,20 +1,39 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, func, BigInteger
+from sqlalchemy import Column, Integer, String, Float, DateTime, func, BigInteger, Index
 from .database import Base
 
+def _not_postgresql(ddl, target, bind, **kw) -> bool:
+    """
+    DDL condition: emit only on dialects other than PostgreSQL.
+    """
+    return kw["dialect"].name != "postgresql"
+
 class Country(Base):
     __tablename__ = "countries"
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String(255), nullable=False, index=True)
+    # Lower-cased copy of `name` for indexed case-insensitive lookups and upserts
+    name_lower = Column(String(255), nullable=False, unique=True, index=True)
     capital = Column(String(255), nullable=True)
-    region = Column(String(255), nullable=True, index=True)
+    region = Column(String(255), nullable=True)
     population = Column(BigInteger, nullable=False)
-    currency_code = Column(String(10), nullable=True, index=True)
+    currency_code = Column(String(10), nullable=True)
     exchange_rate = Column(Float, nullable=True)
-    estimated_gdp = Column(Float, nullable=True, index=True)
+    estimated_gdp = Column(Float, nullable=True)
     flag_url = Column(String(512), nullable=True)
     last_refreshed_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    # Composite indexes matching the /countries filter + sort patterns.
+    # PostgreSQL sorts NULLs first on DESC, so its GDP indexes are declared
+    # NULLS LAST to match the query ordering; MySQL rejects that syntax.
+    __table_args__ = (
+        Index("ix_country_region_gdp", "region", estimated_gdp.desc()).ddl_if(callable_=_not_postgresql),
+        Index("ix_country_currency_gdp", "currency_code", estimated_gdp.desc()).ddl_if(callable_=_not_postgresql),
+        Index("ix_country_region_gdp_pg", "region", estimated_gdp.desc().nulls_last()).ddl_if(dialect="postgresql"),
+        Index("ix_country_currency_gdp_pg", "currency_code", estimated_gdp.desc().nulls_last()).ddl_if(dialect="postgresql"),
+        Index("ix_country_region_name", "region", "name"),
+    )
+
 class AppStatus(Base):
     """
     A simple singleton table to store global app status,
@@ -13,10 +13,6 @@ class CountryBase(BaseModel):
     estimated_gdp: Optional[float] = None
     flag_url: Optional[HttpUrl] = None
 
-# Model for creating a country (used internally)
-class CountryCreate(CountryBase):
-    pass
-
 # Model for updating a country (used internally)
 class CountryUpdate(CountryBase):
     pass
@@ -1,16 +1,47 @@
 import httpx
-import random
+import numpy as np
 import os
 import asyncio
+import time
+import logging
+import hashlib
 from datetime import datetime, timezone
 from sqlalchemy.ext.asyncio import AsyncSession
-from . import crud, schemas
+from . import crud
+from .database import AsyncSessionLocal
+from pydantic import TypeAdapter, HttpUrl, ValidationError
 from PIL import Image, ImageDraw, ImageFont
-from .config import IMAGE_PATH
-from typing import Optional
+from .config import IMAGE_PATH, settings
+from pathlib import Path
+from typing import Optional, Any, Dict, Tuple, List
 
+logger = logging.getLogger(__name__)
 
+# Fonts for the summary image, loaded once. To use a bundled .ttf
+# (e.g. "DejaVuSans.ttf"), swap in ImageFont.truetype("path/to/font.ttf", 15)
+_FONT_TITLE = ImageFont.load_default()
+_FONT_TEXT = _FONT_TITLE
 
+# Validator for the batch of upstream flag URLs
+_FLAG_URLS = TypeAdapter(List[Optional[HttpUrl]])
+
+# Random source for the GDP multiplier
+_rng = np.random.default_rng()
+
+# Timestamp of the last successful refresh in this worker (None until then)
+_last_refreshed_at: Optional[datetime] = None
+
+# Serializes refreshes triggered by the API and by the scheduler
+_refresh_lock = asyncio.Lock()
+
+# Hash of the inputs behind the last rendered summary image
+_image_key: Optional[str] = None
+# ETag of the current summary image (None if there is none yet);
+# taken from disk once at import, then updated on every render
+_image_etag: Optional[str] = None
+
+# In-process cache of upstream payloads: key -> (expires_at, payload)
+_payload_cache: Dict[str, Tuple[float, Any]] = {}
 
 # Define a custom exception for service unavailability
 class ServiceUnavailableException(Exception):
@@ -21,157 +52,285 @@ class ServiceUnavailableException(Exception):
 
 # --- External API Fetching ---
 
-async def fetch_exchange_rates() -> dict:
+def _cache_get(key: str) -> Optional[Any]:
+    """
+    Return a cached payload if it has not expired yet.
+    """
+    entry = _payload_cache.get(key)
+    if entry is None or entry[0] < time.monotonic():
+        return None
+    return entry[1]
+
+def _cache_set(key: str, payload: Any, ttl: int):
+    """
+    Store a payload for `ttl` seconds.
+    """
+    _payload_cache[key] = (time.monotonic() + ttl, payload)
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Build the shared HTTP client used for all upstream API calls.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20),
+        timeout=10.0,
+    )
+
+async def fetch_exchange_rates(client: httpx.AsyncClient, force: bool = False) -> dict:
     """
-    Fetch latest exchange rates from open.er-api.com.
+    Fetch latest exchange rates from open.er-api.com, reusing a cached copy
+    unless `force` is set.
     """
     url = "https://open.er-api.com/v6/latest/USD"
     api_name = "Exchange Rates API"
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, timeout=10.0)
-            response.raise_for_status()
-            return response.json().get("rates", {})
-        except (httpx.RequestError, httpx.TimeoutException) as e:
-            raise ServiceUnavailableException(api_name=api_name, details=str(e))
+    if not force:
+        cached = _cache_get(url)
+        if cached is not None:
+            return cached
+    try:
+        response = await client.get(url)
+        response.raise_for_status()
+        rates = response.json().get("rates", {})
+    except (httpx.RequestError, httpx.TimeoutException) as e:
+        raise ServiceUnavailableException(api_name=api_name, details=str(e))
+    _cache_set(url, rates, settings.RATES_CACHE_TTL)
+    return rates
 
-async def fetch_countries_data() -> list:
+async def fetch_countries_data(client: httpx.AsyncClient, force: bool = False) -> list:
     """
-    Fetch country data from restcountries.com.
+    Fetch country data from restcountries.com, reusing a cached copy
+    unless `force` is set.
     """
     url = "https://restcountries.com/v2/all?fields=name,capital,region,population,flag,currencies"
     api_name = "RestCountries API"
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, timeout=10.0)
-            response.raise_for_status()
-            return response.json()
-        except (httpx.RequestError, httpx.TimeoutException) as e:
-            raise ServiceUnavailableException(api_name=api_name, details=str(e))
+    if not force:
+        cached = _cache_get(url)
+        if cached is not None:
+            return cached
+    try:
+        response = await client.get(url)
+        response.raise_for_status()
+        countries = response.json()
+    except (httpx.RequestError, httpx.TimeoutException) as e:
+        raise ServiceUnavailableException(api_name=api_name, details=str(e))
+    _cache_set(url, countries, settings.COUNTRIES_CACHE_TTL)
+    return countries
 
 # --- Core Refresh Logic ---
 
-async def process_and_cache_countries(db: AsyncSession):
+def _validate_flag_urls(payloads: List[Dict[str, Any]]):
+    """
+    Validate all flag URLs with a single TypeAdapter call, replacing any
+    invalid one with None so it cannot break the /countries response model.
+    """
+    flags = [p["flag_url"] for p in payloads]
+    try:
+        _FLAG_URLS.validate_python(flags)
+    except ValidationError as e:
+        for error in e.errors():
+            index = error["loc"][0]
+            logger.warning("Dropping invalid flag URL for %s: %r", payloads[index]["name"], flags[index])
+            payloads[index]["flag_url"] = None
+
+def _estimate_gdps(payloads: List[Dict[str, Any]]) -> List[Optional[float]]:
+    """
+    Compute estimated_gdp = population * random(1000-2000) / exchange_rate
+    for every payload in one vectorized pass.
+
+    As per spec: 0 when there is no currency or the rate is not positive,
+    None when the currency is missing from the rates API.
+    """
+    if not payloads:
+        return []
+
+    populations = np.fromiter((p["population"] for p in payloads), dtype=np.float64, count=len(payloads))
+    rates = np.array(
+        [np.nan if p["exchange_rate"] is None else p["exchange_rate"] for p in payloads],
+        dtype=np.float64,
+    )
+    multipliers = _rng.integers(1000, 2001, size=len(payloads))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gdps = np.where(rates > 0, populations * multipliers / rates, 0.0)
+
+    # Currency code exists but not in rates API
+    unknown_rate = [p["currency_code"] is not None and p["exchange_rate"] is None for p in payloads]
+    return [None if unknown else gdp for gdp, unknown in zip(gdps.tolist(), unknown_rate)]
+
+async def process_and_cache_countries(db: AsyncSession, client: httpx.AsyncClient, force: bool = False):
     """
     Main logic to fetch from APIs, process data, and cache in the DB.
     """
-    # Fetch data from both APIs concurrently
+    global _last_refreshed_at
+
+    # Fetch data from both APIs concurrently (served from cache when warm)
     try:
         rates, countries = await asyncio.gather(
-            fetch_exchange_rates(),
-            fetch_countries_data()
+            fetch_exchange_rates(client, force=force),
+            fetch_countries_data(client, force=force)
         )
     except ServiceUnavailableException:
         # Re-raise to be caught by the endpoint's error handler
         raise
 
-    refresh_time = datetime.now(timezone.utc)
+    # Whole seconds, matching what a MySQL DATETIME column stores
+    refresh_time = datetime.now(timezone.utc).replace(microsecond=0)
+    # Rows are plain dicts keyed by column name; instead of per-row Pydantic
+    # models, only flag_url is validated, once for the whole batch
+    payloads = []
+    append_payload = payloads.append
+    rates_get = rates.get
     
     for country_data in countries:
-        name = country_data.get("name")
-        population = country_data.get("population")
+        get = country_data.get
+        name = get("name")
+        population = get("population")
 
         # Skip records with missing essential data
         if not name or population is None:
             continue
 
         currency_code: Optional[str] = None
-        exchange_rate: Optional[float] = None
-        estimated_gdp: Optional[float] = 0.0  # Default to 0
 
         # Handle currency data
-        currencies = country_data.get("currencies", [])
+        currencies = get("currencies")
         if currencies and isinstance(currencies, list):
             first_currency = currencies[0]
             if isinstance(first_currency, dict):
-                currency_code = first_currency.get("code")
-
-        # Calculate GDP if possible
-        if currency_code and currency_code in rates:
-            exchange_rate = rates[currency_code]
-            if exchange_rate > 0: # Avoid division by zero
-                random_multiplier = random.randint(1000, 2000)
-                estimated_gdp = (population * random_multiplier) / exchange_rate
-            else:
-                estimated_gdp = 0.0 # Set to 0 if rate is 0
-        elif currency_code:
-            # Currency code exists but not in rates API
-            exchange_rate = None
-            estimated_gdp = None # Set to null as per spec
-        else:
-            # No currency array
-            currency_code = None
-            exchange_rate = None
-            estimated_gdp = 0.0 # Set to 0 as per spec
-
-        # Prepare data payload
-        country_payload = schemas.CountryCreate(
-            name=name,
-            capital=country_data.get("capital"),
-            region=country_data.get("region"),
-            population=population,
-            currency_code=currency_code,
-            exchange_rate=exchange_rate,
-            estimated_gdp=estimated_gdp,
-            flag_url=country_data.get("flag")
-        )
+                currency_code = first_currency.get("code") or None
 
-        # Update or insert the country
-        await crud.upsert_country(db, country_payload)
-    
-    # Update the global refresh timestamp
-    await crud.update_app_status(db, refresh_time)
-    
-    # Commit the entire transaction
-    await db.commit()
+        append_payload({
+            "name": name,
+            "name_lower": name.lower(),
+            "capital": get("capital"),
+            "region": get("region"),
+            "population": population,
+            "currency_code": currency_code,
+            "exchange_rate": rates_get(currency_code) if currency_code else None,
+            "flag_url": get("flag"),
+        })
+
+    # Validate every flag URL in one pass, as the API serves them as HttpUrl
+    _validate_flag_urls(payloads)
+
+    # Calculate GDP for the whole batch at once
+    estimated_gdps = _estimate_gdps(payloads)
+
+    for payload, estimated_gdp in zip(payloads, estimated_gdps):
+        payload["estimated_gdp"] = estimated_gdp
+
+    # Write everything in one transaction, committed when the block exits;
+    # autoflush is off so nothing is sent before the explicit statements
+    async with db.begin():
+        with db.no_autoflush:
+            # Update or insert all countries in a single statement
+            await crud.bulk_upsert_countries(db, payloads)
+
+            # Update the global refresh timestamp
+            await crud.update_app_status(db, refresh_time)
+
+    # Committed; serve the new timestamp from memory from now on
+    _last_refreshed_at = refresh_time
 
     # Generate summary image after successful refresh
     await generate_summary_image(db)
     
     return {"status": "success", "refreshed_at": refresh_time}
 
+def get_last_refreshed_at() -> Optional[datetime]:
+    """
+    Last refresh time committed by this worker, or None if it has not
+    refreshed yet.
+    """
+    return _last_refreshed_at
+
+def refresh_in_progress() -> bool:
+    """
+    Whether a refresh is currently running in this worker.
+    """
+    return _refresh_lock.locked()
+
+async def run_refresh(client: httpx.AsyncClient, force: bool = False):
+    """
+    Run a full refresh in its own session, outside of any request.
+    Used by the background task and the periodic scheduler.
+    """
+    if _refresh_lock.locked():
+        logger.info("Country refresh already in progress, skipping")
+        return
+
+    async with _refresh_lock:
+        try:
+            async with AsyncSessionLocal() as db:
+                await process_and_cache_countries(db, client, force=force)
+        except Exception:
+            logger.exception("Country refresh failed")
+
 # --- Image Generation ---
 
-async def generate_summary_image(db: AsyncSession):
+def _etag_for(path: Path) -> str:
     """
-    Generates a summary image and saves it to 'cache/summary.png'.
+    Build an ETag for the file at `path` from its modification time.
     """
-    # Fetch data needed for the image
-    total = await crud.get_countries_count(db)
-    top_5 = await crud.get_top_gdp_countries(db)
-    status = await crud.get_app_status(db)
-    timestamp = status.last_refreshed_at.strftime("%Y-%m-%d %H:%M:%S UTC") if status and status.last_refreshed_at else "N/A"
+    return f'"{path.stat().st_mtime_ns:x}"'
 
+def _render_png(top_5: List[Tuple[str, Optional[float]]], total: int, timestamp: str, path: Path) -> str:
+    """
+    Draw the summary image and write it to `path`. CPU-bound, so it is run
+    in a worker thread. Returns the ETag of the written file.
+    """
     # Create image
     img = Image.new('RGB', (600, 400), color='white')
     d = ImageDraw.Draw(img)
 
-    # Try to load a font; fall back to default
-    try:
-        # You can bundle a .ttf font file (e.g., "DejaVuSans.ttf")
-        # and use ImageFont.truetype("path/to/font.ttf", 15)
-        font_title = ImageFont.load_default()
-        font_text = ImageFont.load_default()
-    except IOError:
-        font_title = ImageFont.load_default()
-        font_text = ImageFont.load_default()
-
     # Draw text
-    d.text((20, 20), "Country Data Summary", fill='black', font=font_title)
-    d.text((20, 50), f"Last Refresh: {timestamp}", fill='darkgray', font=font_text)
-    d.text((20, 80), f"Total Cached Countries: {total}", fill='black', font=font_text)
+    d.text((20, 20), "Country Data Summary", fill='black', font=_FONT_TITLE)
+    d.text((20, 50), f"Last Refresh: {timestamp}", fill='darkgray', font=_FONT_TEXT)
+    d.text((20, 80), f"Total Cached Countries: {total}", fill='black', font=_FONT_TEXT)
     
-    d.text((20, 120), "Top 5 Countries by Estimated GDP:", fill='blue', font=font_text)
+    d.text((20, 120), "Top 5 Countries by Estimated GDP:", fill='blue', font=_FONT_TEXT)
     y_pos = 150
-    for i, country in enumerate(top_5):
-        gdp_str = f"${country.estimated_gdp:,.2f}" if country.estimated_gdp is not None else "N/A"
-        text = f"{i+1}. {country.name} ({gdp_str})"
-        d.text((30, y_pos), text, fill='black', font=font_text)
+    for i, (name, estimated_gdp) in enumerate(top_5):
+        gdp_str = f"${estimated_gdp:,.2f}" if estimated_gdp is not None else "N/A"
+        text = f"{i+1}. {name} ({gdp_str})"
+        d.text((30, y_pos), text, fill='black', font=_FONT_TEXT)
         y_pos += 30
 
     # Ensure cache directory exists
-    if not os.path.exists('cache'):
-        os.makedirs('cache')
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Save the image atomically so readers never see a partial file;
+    # fast compression since it is regenerated on every refresh
+    tmp_path = path.with_suffix(".png.tmp")
+    img.save(str(tmp_path), format="PNG", optimize=False, compress_level=1)
+    os.replace(tmp_path, path)
+    return _etag_for(path)
+
+async def generate_summary_image(db: AsyncSession):
+    """
+    Generates a summary image and saves it to 'cache/summary.png'.
+    Skipped when the inputs are unchanged since the last render.
+    """
+    global _image_key, _image_etag
+
+    # Fetch data needed for the image
+    total, last_refreshed_at = await crud.get_status_bundle(db)
+    top_5 = [tuple(row) for row in await crud.get_top_gdp_projection(db)]
+    timestamp = last_refreshed_at.strftime("%Y-%m-%d %H:%M:%S UTC") if last_refreshed_at else "N/A"
+
+    key = hashlib.blake2b(repr((top_5, total, timestamp)).encode()).hexdigest()
+    if key == _image_key and _image_etag is not None:
+        return
+
+    _image_etag = await asyncio.to_thread(_render_png, top_5, total, timestamp, IMAGE_PATH)
+    _image_key = key
+
+def summary_image_etag() -> Optional[str]:
+    """
+    ETag of the summary image, or None if no image is available to serve.
+    """
+    return _image_etag
 
-    # Save the image
-    img.save(str(IMAGE_PATH))
\ No newline at end of file
+if IMAGE_PATH.exists():
+    _image_etag = _etag_for(IMAGE_PATH)
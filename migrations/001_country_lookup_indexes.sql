@@ -0,0 +1,21 @@
+-- Upgrade an existing `countries` table (created before name_lower was added).
+-- Base.metadata.create_all only creates missing tables and never alters
+-- existing ones, so run this once against databases created by older versions.
+-- MySQL syntax.
+
+-- Lower-cased name used for case-insensitive lookups and as the upsert key.
+-- If two rows have names that differ only in case, delete one of them
+-- before creating the unique index.
+ALTER TABLE countries ADD COLUMN name_lower VARCHAR(255) NULL AFTER name;
+UPDATE countries SET name_lower = LOWER(name);
+ALTER TABLE countries MODIFY name_lower VARCHAR(255) NOT NULL;
+CREATE UNIQUE INDEX ix_countries_name_lower ON countries (name_lower);
+
+-- Composite indexes for the /countries filter + sort patterns; they replace
+-- the standalone estimated_gdp, region and currency_code indexes.
+CREATE INDEX ix_country_region_gdp ON countries (region, estimated_gdp DESC);
+CREATE INDEX ix_country_currency_gdp ON countries (currency_code, estimated_gdp DESC);
+CREATE INDEX ix_country_region_name ON countries (region, name);
+DROP INDEX ix_countries_estimated_gdp ON countries;
+DROP INDEX ix_countries_region ON countries;
+DROP INDEX ix_countries_currency_code ON countries;